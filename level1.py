@@ -1,28 +1,36 @@
 import os
 import sys
+import argparse
 import subprocess
+import importlib.util
 import time
+import re
 import json
-import requests
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import networkx as nx
-from urllib.parse import urlparse, parse_qs
 
 # ===========================
 # Dependency check and install
 # ===========================
-REQUIRED = ["pandas", "networkx", "requests", "serpapi", "openpyxl", "tqdm"]
+REQUIRED = ["numpy", "pandas", "networkx", "serpapi", "xlsxwriter", "pyarrow", "tqdm", "aiohttp", "orjson"]
 
 def ensure_deps():
+    # find_spec only locates the package; nothing is imported until it is actually used
     for pkg in REQUIRED:
-        try:
-            __import__(pkg)
-        except ImportError:
+        if importlib.util.find_spec(pkg) is None:
             print(f"Installing missing package: {pkg}")
             subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
+            importlib.invalidate_caches()
 
 ensure_deps()
 
+import aiohttp
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 from serpapi import GoogleSearch
 from tqdm import tqdm
 
@@ -36,21 +44,172 @@ MAX_PUBS = 5
 MAX_CITES_PER_PUB = 500
 
 CROSSREF_API = "https://api.crossref.org/works"
+CROSSREF_MAILTO = ""  # contact email for Crossref's polite pool
+LENS_PATENT_API = "https://api.lens.org/patent/search"
+SERPAPI_SEARCH_API = "https://serpapi.com/search.json"
+SERPAPI_ARCHIVE_API = "https://serpapi.com/searches/{}.json"
 SERPAPI_PAGE_SIZE_AUTHOR = 100
-SERPAPI_PAGE_SIZE_CITES = 100
-
-SLEEP_AUTHOR_PAGE = 1.0
-SLEEP_CITES_PAGE = 1.0
-SLEEP_CROSSREF = 0.25
-SLEEP_LENS = 0.5
+SERPAPI_PAGE_SIZE_CITES = 20  # google_scholar engine caps "num" at 20
+SERPAPI_CONCURRENCY = 5
+CROSSREF_CONCURRENCY = 8
+LENS_CONCURRENCY = 2
+HTTP_MAX_CONNECTIONS = 50
+
+# Starting request rates (per second); raised or lowered from each API's rate-limit headers
+SERPAPI_RATE = 5.0
+CROSSREF_RATE = 10.0
+LENS_RATE = 2.0
+RATE_LIMIT_BACKOFF = 5.0
+HTTP_MAX_RETRIES = 3
+
+SERPAPI_POLL_INITIAL = 1.0
+SERPAPI_POLL_MAX = 16.0
+SERPAPI_POLL_TIMEOUT = 180.0
+
+PUBS_CACHE_TTL = 24 * 3600  # seconds a cached publication list stays fresh
+CSV_CHUNKSIZE = 50_000
+EXPORT_WORKERS = 4
+
+# Low-cardinality class columns are dictionary-encoded and load back as pandas categoricals
+CITATION_SCHEMA = pa.schema([
+    ("cited_pub_title", pa.string()),
+    ("cited_pub_year", pa.string()),
+    ("cited_by_count_at_scrape", pa.int64()),
+    ("citing_title", pa.string()),
+    ("citing_container", pa.string()),
+    ("citing_url", pa.string()),
+    ("citing_snippet", pa.string()),
+    ("final_class", pa.dictionary(pa.int32(), pa.string())),
+    ("crossref_type", pa.dictionary(pa.int32(), pa.string())),
+    ("lens_id", pa.string()),
+    ("lens_publication_number", pa.string()),
+    ("lens_publication_date", pa.string()),
+    ("lens_jurisdiction", pa.string()),
+    ("lens_family_id", pa.string()),
+    ("lens_applicants", pa.string()),
+    ("lens_owners", pa.string()),
+    ("lens_inventors", pa.string()),
+])
 
 OUTPUT_DIR = "scholar_outputs_with_progress_bar"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+CROSSREF_CACHE_FILE = os.path.join(OUTPUT_DIR, "crossref_cache.jsonl")
+LENS_CACHE_FILE = os.path.join(OUTPUT_DIR, "lens_cache.jsonl")
+
+# ===========================
+# Lookup caches
+# ===========================
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+def norm_title(title: str) -> str:
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", (title or "").lower())).strip()
+
+def load_jsonl_cache(path: str, value_key: str) -> dict:
+    cache = {}
+    if not os.path.exists(path):
+        return cache
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+                cache[rec["q"]] = rec.get(value_key)
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+    return cache
+
+def append_jsonl_cache(path: str, cache: dict, key: str, value_key: str, value):
+    cache[key] = value
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"q": key, value_key: value}) + "\n")
+
+# Lookups are keyed by normalized title; negative answers are cached too
+CROSSREF_CACHE = load_jsonl_cache(CROSSREF_CACHE_FILE, "type")
+LENS_CACHE = load_jsonl_cache(LENS_CACHE_FILE, "meta")
+
+# ===========================
+# Rate limiting
+# ===========================
+def header_seconds(headers, *names) -> float | None:
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(str(value).strip().rstrip("s"))
+        except ValueError:
+            continue
+    return None
+
+class RateLimiter:
+    """Spaces requests to one API at `rate` per second and pauses when the API asks for it."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.next_slot = 0.0
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        # Slots are reserved without awaiting in between, so no lock is needed (and none is tied to a loop)
+        while True:
+            now = time.monotonic()
+            start = max(now, self.next_slot, self.paused_until)
+            self.next_slot = start + 1.0 / self.rate
+            if start > now:
+                await asyncio.sleep(start - now)
+            if time.monotonic() >= self.paused_until:
+                return
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe(self, resp: aiohttp.ClientResponse) -> bool:
+        # Returns True when the request was rate limited and should be retried
+        h = resp.headers
+        limit = header_seconds(h, "X-Rate-Limit-Limit")
+        interval = header_seconds(h, "X-Rate-Limit-Interval")
+        if limit and interval:
+            self.rate = limit / interval
+        retry_after = header_seconds(h, "Retry-After", "X-Rate-Limit-Retry-After-Seconds")
+        if resp.status == 429:
+            self.pause(retry_after or RATE_LIMIT_BACKOFF)
+            return True
+        remaining = header_seconds(h, "X-RateLimit-Remaining", "X-Rate-Limit-Remaining-Request-Per-Minute")
+        if remaining == 0:
+            self.pause(retry_after or header_seconds(h, "X-RateLimit-Reset") or RATE_LIMIT_BACKOFF)
+        return False
+
+SERPAPI_LIMITER = RateLimiter(SERPAPI_RATE)
+CROSSREF_LIMITER = RateLimiter(CROSSREF_RATE)
+LENS_LIMITER = RateLimiter(LENS_RATE)
+
+async def limited_request_json(session: aiohttp.ClientSession, sem: asyncio.Semaphore, limiter: RateLimiter,
+                               method: str, url: str, **kwargs) -> dict:
+    for _ in range(HTTP_MAX_RETRIES):
+        async with sem:
+            await limiter.acquire()
+            async with session.request(method, url, **kwargs) as resp:
+                if limiter.observe(resp):
+                    continue
+                resp.raise_for_status()
+                return await resp.json(content_type=None) or {}
+    raise aiohttp.ClientError(f"Still rate limited after {HTTP_MAX_RETRIES} attempts: {url}")
 
 # ===========================
 # Helper functions
 # ===========================
-def get_publications(author_id: str) -> list:
+def get_publications(author_id: str, refresh: bool = False) -> list:
+    safe_id = re.sub(r"[^\w-]", "_", author_id)
+    cache_path = os.path.join(OUTPUT_DIR, f"pubs_{safe_id}.json")
+    if not refresh and os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < PUBS_CACHE_TTL:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                pubs = json.load(f)
+            print(f"Using cached publication list {cache_path} (run with --refresh to re-fetch).")
+            return pubs
+        except (OSError, json.JSONDecodeError):
+            pass
+
     pubs = []
     start = 0
     while True:
@@ -70,122 +229,209 @@ def get_publications(author_id: str) -> list:
         if not has_next:
             break
         start += SERPAPI_PAGE_SIZE_AUTHOR
-        time.sleep(SLEEP_AUTHOR_PAGE)
+    if pubs:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(pubs, f)
     return pubs
 
+_CITES_RE = re.compile(r"[?&]cites=([^&#]+)")
+
 def extract_cites_id(cited_by_link: str) -> str | None:
-    if not cited_by_link:
-        return None
+    m = _CITES_RE.search(cited_by_link or "")
+    return m.group(1) if m else None
+
+def new_session() -> aiohttp.ClientSession:
+    # One pooled session per run keeps connections to SerpAPI, Crossref and Lens alive between batches
+    user_agent = "ScholarlyImpactAnalysis/1.0" + (f" (mailto:{CROSSREF_MAILTO})" if CROSSREF_MAILTO else "")
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS, ttl_dns_cache=300),
+        headers={"User-Agent": user_agent},
+    )
+
+async def serpapi_get_json(session: aiohttp.ClientSession, sem: asyncio.Semaphore, url: str, params: dict) -> dict:
     try:
-        parsed = urlparse(cited_by_link)
-        q = parse_qs(parsed.query)
-        if "cites" in q and q["cites"]:
-            return q["cites"][0]
-        if "cites=" in cited_by_link:
-            return cited_by_link.split("cites=")[1].split("&")[0]
+        return await limited_request_json(session, sem, SERPAPI_LIMITER, "GET", url, params=params,
+                                          timeout=aiohttp.ClientTimeout(total=60))
     except Exception:
-        return None
-    return None
+        return {}
 
-def get_citing_articles_by_cites_id(cites_id: str, max_items: int) -> list:
-    results_all = []
-    start = 0
-    while True:
+async def get_citing_articles_by_cites_id(session: aiohttp.ClientSession, sem: asyncio.Semaphore,
+                                          cites_id: str, max_items: int) -> list:
+    async def submit(start: int) -> dict:
         params = {
             "engine": "google_scholar",
             "api_key": SERPAPI_KEY,
-            "start": start,
-            "cites": cites_id
+            "start": str(start),
+            "num": str(SERPAPI_PAGE_SIZE_CITES),
+            "cites": cites_id,
+            "async": "true"
         }
-        results = GoogleSearch(params).get_dict()
-        articles = results.get("organic_results", [])
-        if not articles:
-            break
-        results_all.extend(articles)
-        if len(results_all) >= max_items:
-            break
-        has_next = results.get("serpapi_pagination", {}).get("next")
-        if not has_next:
-            break
-        start += SERPAPI_PAGE_SIZE_CITES
-        time.sleep(SLEEP_CITES_PAGE)
+        return await serpapi_get_json(session, sem, SERPAPI_SEARCH_API, params)
+
+    async def collect(results: dict) -> list:
+        # Async searches come back as "Processing"; poll the archive with backoff until done
+        search_id = safe_get(results, ["search_metadata", "id"])
+        delay, waited = SERPAPI_POLL_INITIAL, 0.0
+        while search_id and safe_get(results, ["search_metadata", "status"]) not in ("Success", "Error"):
+            if waited >= SERPAPI_POLL_TIMEOUT:
+                return []
+            await asyncio.sleep(delay)
+            waited += delay
+            delay = min(delay * 2, SERPAPI_POLL_MAX)
+            results = await serpapi_get_json(session, sem, SERPAPI_ARCHIVE_API.format(search_id),
+                                             {"api_key": SERPAPI_KEY})
+        return results.get("organic_results", []) or []
+
+    if not cites_id or max_items <= 0:
+        return []
+    starts = range(0, max_items, SERPAPI_PAGE_SIZE_CITES)
+    submitted = await asyncio.gather(*[submit(start) for start in starts])
+    pages = await asyncio.gather(*[collect(results) for results in submitted])
+    results_all = [article for page in pages for article in page]
     return results_all[:max_items]
 
-def crossref_lookup_type(title: str) -> str:
-    if not title:
+async def fetch_citing_articles(session: aiohttp.ClientSession, targets: list) -> list:
+    # targets: [(cites_id, max_items), ...]; gathered together so pages of all pubs overlap
+    sem = asyncio.Semaphore(SERPAPI_CONCURRENCY)
+    return await asyncio.gather(*[
+        get_citing_articles_by_cites_id(session, sem, cites_id, max_items)
+        for cites_id, max_items in targets
+    ])
+
+async def crossref_lookup_type(session: aiohttp.ClientSession, sem: asyncio.Semaphore, title: str) -> str:
+    key = norm_title(title)
+    if not key:
         return "unknown"
+    if key in CROSSREF_CACHE:
+        return CROSSREF_CACHE[key]
+    params = {"query.bibliographic": title, "rows": "1"}
+    if CROSSREF_MAILTO:
+        params["mailto"] = CROSSREF_MAILTO
     try:
-        r = requests.get(CROSSREF_API, params={"query.title": title, "rows": 1}, timeout=12)
-        r.raise_for_status()
-        items = r.json().get("message", {}).get("items", [])
-        if items:
-            return items[0].get("type", "unknown") or "unknown"
+        data = await limited_request_json(session, sem, CROSSREF_LIMITER, "GET", CROSSREF_API, params=params,
+                                          timeout=aiohttp.ClientTimeout(total=12))
     except Exception:
-        pass
-    finally:
-        time.sleep(SLEEP_CROSSREF)
-    return "unknown"
-
-def heuristic_classify(title: str, container: str) -> str:
-    t = (title or "").lower()
-    c = (container or "").lower()
-    if any(w in t or w in c for w in ["review", "survey", "meta-analysis", "systematic review"]):
-        return "review"
-    if "patent" in t or "patent" in c:
-        return "patent"
-    if any(w in t or w in c for w in ["book", "chapter", "handbook", "monograph", "springer", "igi-global", "ieee press", "acm books"]):
-        return "book"
-    if any(w in t or w in c for w in ["thesis", "dissertation", "phd", "masters"]):
-        return "thesis"
-    return "unknown"
-
-def lens_patent_search_by_title(title: str) -> dict | None:
+        return "unknown"
+    items = data.get("message", {}).get("items", [])
+    crossref_type = (items[0].get("type", "unknown") or "unknown") if items else "unknown"
+    append_jsonl_cache(CROSSREF_CACHE_FILE, CROSSREF_CACHE, key, "type", crossref_type)
+    return crossref_type
+
+async def lens_patent_search_by_title(session: aiohttp.ClientSession, sem: asyncio.Semaphore, title: str) -> dict | None:
     if not title or not LENS_API_TOKEN or LENS_API_TOKEN.startswith("YOUR_"):
         return None
-    url = "https://api.lens.org/patent/search"
+    key = norm_title(title)
+    if key in LENS_CACHE:
+        return LENS_CACHE[key]
     headers = {"Authorization": f"Bearer {LENS_API_TOKEN}", "Content-Type": "application/json"}
     body = {"query": {"bool": {"must": [{"match": {"title": {"query": title}}}]}},
             "size": 1,
             "include": ["lens_id","title","jurisdiction","publication_number","publication_date","family_id","applicants","owners","inventors"]}
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps(body), timeout=20)
-        resp.raise_for_status()
-        data = resp.json()
-        hits = data.get("data", []) or data.get("results", []) or []
-        if hits:
-            hit = hits[0]
-            return {
-                "lens_id": hit.get("lens_id"),
-                "title": hit.get("title"),
-                "jurisdiction": hit.get("jurisdiction"),
-                "publication_number": hit.get("publication_number"),
-                "publication_date": hit.get("publication_date"),
-                "family_id": hit.get("family_id"),
-                "applicants": hit.get("applicants"),
-                "owners": hit.get("owners"),
-                "inventors": hit.get("inventors"),
-            }
+        data = await limited_request_json(session, sem, LENS_LIMITER, "POST", LENS_PATENT_API, headers=headers,
+                                          json=body, timeout=aiohttp.ClientTimeout(total=20))
     except Exception:
         return None
-    finally:
-        time.sleep(SLEEP_LENS)
-    return None
-
-def classify_item(title: str, container: str):
-    crossref_type = crossref_lookup_type(title)
-    prelim = "unknown"
-    if "review" in crossref_type:
-        prelim = "review"
-    elif "patent" in crossref_type:
-        prelim = "patent"
-    elif "book" in crossref_type or "chapter" in crossref_type:
-        prelim = "book"
-    if prelim == "unknown":
-        prelim = heuristic_classify(title, container)
+    hits = data.get("data", []) or data.get("results", []) or []
     lens_meta = None
-    if prelim == "patent":
-        lens_meta = lens_patent_search_by_title(title)
-    return prelim, crossref_type, lens_meta
+    if hits:
+        hit = hits[0]
+        lens_meta = {
+            "lens_id": hit.get("lens_id"),
+            "title": hit.get("title"),
+            "jurisdiction": hit.get("jurisdiction"),
+            "publication_number": hit.get("publication_number"),
+            "publication_date": hit.get("publication_date"),
+            "family_id": hit.get("family_id"),
+            "applicants": hit.get("applicants"),
+            "owners": hit.get("owners"),
+            "inventors": hit.get("inventors"),
+        }
+    append_jsonl_cache(LENS_CACHE_FILE, LENS_CACHE, key, "meta", lens_meta)
+    return lens_meta
+
+async def lookup_crossref_types(session: aiohttp.ClientSession, titles: list) -> list:
+    sem = asyncio.Semaphore(CROSSREF_CONCURRENCY)
+    return await asyncio.gather(*[crossref_lookup_type(session, sem, title) for title in titles])
+
+async def crossref_types_for(session: aiohttp.ClientSession, titles: pd.Series) -> pd.Series:
+    # One lookup per distinct normalized title, mapped back onto every row
+    titles = titles.fillna("").astype(str)
+    keys = titles.map(norm_title)
+    first_titles = titles.groupby(keys, sort=False).first()
+    types = await lookup_crossref_types(session, first_titles.tolist())
+    return keys.map(dict(zip(first_titles.index, types))).fillna("unknown")
+
+# Checked in order; the first matching group wins
+HEURISTIC_KEYWORDS = [
+    ("review", ["review", "survey", "meta-analysis", "systematic review"]),
+    ("patent", ["patent"]),
+    ("book", ["book", "chapter", "handbook", "monograph", "springer", "igi-global", "ieee press", "acm books"]),
+    ("thesis", ["thesis", "dissertation", "phd", "masters"]),
+]
+HEURISTIC_PATTERNS = [(label, re.compile("|".join(re.escape(w) for w in words)))
+                      for label, words in HEURISTIC_KEYWORDS]
+
+def heuristic_classify(titles: pd.Series, containers: pd.Series) -> pd.Series:
+    # Title and container are scanned as one buffer; keywords never contain the newline separator
+    text = (titles.fillna("").astype(str) + "\n" + containers.fillna("").astype(str)).str.lower()
+    conds = [text.str.contains(pattern).to_numpy(dtype=bool) for _, pattern in HEURISTIC_PATTERNS]
+    labels = [label for label, _ in HEURISTIC_PATTERNS]
+    return pd.Series(np.select(conds, labels, default="unknown"), index=titles.index)
+
+def classify_frame(df: pd.DataFrame, heuristic: pd.Series | None = None) -> pd.Series:
+    if heuristic is None:
+        heuristic = heuristic_classify(df["citing_title"], df["citing_container"])
+    cr = df["crossref_type"].fillna("unknown").astype(str)
+    prelim = pd.Series(np.select(
+        [cr.str.contains("review", regex=False).to_numpy(dtype=bool),
+         cr.str.contains("patent", regex=False).to_numpy(dtype=bool),
+         cr.str.contains("book|chapter", regex=True).to_numpy(dtype=bool)],
+        ["review", "patent", "book"], default="unknown"), index=df.index)
+    return prelim.where(prelim != "unknown", heuristic)
+
+async def classify_batch(session: aiohttp.ClientSession, batch: pd.DataFrame) -> pd.DataFrame:
+    heuristic = heuristic_classify(batch["citing_title"], batch["citing_container"])
+    lens_sem = asyncio.Semaphore(LENS_CONCURRENCY)
+
+    def lens_task(idx):
+        return asyncio.create_task(lens_patent_search_by_title(session, lens_sem, batch.at[idx, "citing_title"]))
+
+    # Heuristic patents almost always stay patents, so their Lens searches run alongside Crossref
+    lens_tasks = {idx: lens_task(idx) for idx in batch.index[heuristic == "patent"]}
+    batch["crossref_type"] = await crossref_types_for(session, batch["citing_title"])
+    batch["final_class"] = classify_frame(batch, heuristic)
+    patent_idx = batch.index[batch["final_class"] == "patent"]
+
+    overruled = [task for idx, task in lens_tasks.items() if idx not in patent_idx]
+    for task in overruled:
+        task.cancel()
+    await asyncio.gather(*overruled, return_exceptions=True)
+    if len(patent_idx):
+        for idx in patent_idx.difference(list(lens_tasks)):
+            lens_tasks[idx] = lens_task(idx)
+        lens_metas = await asyncio.gather(*[lens_tasks[idx] for idx in patent_idx])
+        lens_df = pd.DataFrame([lens_fields(m) for m in lens_metas], index=patent_idx)
+        for col in lens_df.columns:
+            batch[col] = batch[col].astype(object)
+            batch.loc[patent_idx, col] = lens_df[col]
+    return batch
+
+def lens_json(value) -> str:
+    # orjson writes compact JSON, e.g. [{"name":"A"}], and is much cheaper per call than json.dumps
+    return orjson.dumps(value).decode()
+
+def lens_fields(lens_meta: dict | None) -> dict:
+    return {
+        "lens_id": (lens_meta or {}).get("lens_id"),
+        "lens_publication_number": (lens_meta or {}).get("publication_number"),
+        "lens_publication_date": (lens_meta or {}).get("publication_date"),
+        "lens_jurisdiction": (lens_meta or {}).get("jurisdiction"),
+        "lens_family_id": (lens_meta or {}).get("family_id"),
+        "lens_applicants": lens_json(lens_meta.get("applicants")) if lens_meta else None,
+        "lens_owners": lens_json(lens_meta.get("owners")) if lens_meta else None,
+        "lens_inventors": lens_json(lens_meta.get("inventors")) if lens_meta else None,
+    }
 
 def safe_get(dic: dict, path: list, default=None):
     cur = dic or {}
@@ -196,21 +442,32 @@ def safe_get(dic: dict, path: list, default=None):
             return default
     return cur
 
+def arrow_to_frame(table: pa.Table) -> pd.DataFrame:
+    # Arrow-backed columns instead of one Python object per cell; dictionary columns become categoricals
+    return table.to_pandas(types_mapper=lambda t: None if pa.types.is_dictionary(t) else pd.ArrowDtype(t))
+
 def build_graph_and_export(df: pd.DataFrame):
-    G = nx.DiGraph()
-    for pub_title in sorted(df["cited_pub_title"].dropna().unique()):
-        G.add_node(f"PUB::{pub_title}", node_type="source_pub")
-    for _, row in df.iterrows():
-        pub_node = f"PUB::{row['cited_pub_title']}"
-        cite_node = f"CITE::{row['citing_title']}"
-        G.add_node(cite_node, node_type=row["final_class"] or "unknown")
-        G.add_edge(pub_node, cite_node)
+    edges = pd.DataFrame({
+        "src": "PUB::" + df["cited_pub_title"].fillna("").astype(str),
+        "dst": "CITE::" + df["citing_title"].fillna("").astype(str),
+    })
+    G = nx.from_pandas_edgelist(edges, "src", "dst", create_using=nx.DiGraph)
+    nx.set_node_attributes(G, dict(zip(edges["dst"].to_numpy(), df["final_class"].fillna("unknown").to_numpy())), "node_type")
+    nx.set_node_attributes(G, {f"PUB::{t}": "source_pub" for t in df["cited_pub_title"].dropna().unique()}, "node_type")
     gexf_path = os.path.join(OUTPUT_DIR, "citation_graph.gexf")
     graphml_path = os.path.join(OUTPUT_DIR, "citation_graph.graphml")
-    nx.write_gexf(G, gexf_path)
-    nx.write_graphml(G, graphml_path)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futures = [ex.submit(nx.write_gexf, G, gexf_path), ex.submit(nx.write_graphml, G, graphml_path)]
+        for f in futures:
+            f.result()
     return gexf_path, graphml_path
 
+def write_excel(path: str, sheets: dict):
+    # xlsxwriter's constant_memory mode needs row-major writes, but pandas writes column by column
+    with pd.ExcelWriter(path, engine="xlsxwriter") as xw:
+        for sheet_name, frame in sheets.items():
+            frame.to_excel(xw, index=False, sheet_name=sheet_name)
+
 # ===========================
 # Core logic with progress bar
 # ===========================
@@ -223,60 +480,69 @@ def verify_top(pub):
         print("No citations found for this publication.")
         return False
     cites_id = extract_cites_id(link)
-    items = get_citing_articles_by_cites_id(cites_id, 100)
+    async def fetch():
+        async with new_session() as session:
+            return (await fetch_citing_articles(session, [(cites_id, 100)]))[0]
+    items = asyncio.run(fetch())
     print(f"Top cited paper: {p_title} | citing items retrieved: {len(items)}")
     return True
 
-def run_full(pubs):
-    rows = []
-    with tqdm(total=len(pubs[:MAX_PUBS]), desc="Processing publications", unit="pub") as pbar:
-        for idx, pub in enumerate(pubs[:MAX_PUBS], 1):
-            p_title = pub.get("title")
-            p_year = safe_get(pub, ["year"])
-            cited_by = pub.get("cited_by") or {}
-            cite_count = cited_by.get("value", 0)
-            link = cited_by.get("link")
-            if not link or cite_count == 0:
+async def collect_citations(targets: list, path_parquet: str) -> int:
+    async with new_session() as session:
+        print(f"Fetching citing items for {len(targets)} publications...")
+        citing_lists = await fetch_citing_articles(session, [(cites_id, n) for _, _, cites_id, n in targets])
+
+        # Each publication's batch is classified and appended to Parquet, so only one batch of rows is held
+        n_rows = 0
+        with pq.ParquetWriter(path_parquet, CITATION_SCHEMA) as writer, \
+                tqdm(total=len(targets), desc="Processing publications", unit="pub") as pbar:
+            for i, (pub, cite_count, _, _) in enumerate(targets):
+                citing_items, citing_lists[i] = citing_lists[i], None
+                if citing_items:
+                    # Built column-wise; per-publication values broadcast over the batch
+                    batch = pd.DataFrame({
+                        "cited_pub_title": pub.get("title"),
+                        "cited_pub_year": safe_get(pub, ["year"]),
+                        "cited_by_count_at_scrape": cite_count,
+                        "citing_title": [item.get("title") or "" for item in citing_items],
+                        "citing_container": [safe_get(item, ["publication_info", "summary"], "") for item in citing_items],
+                        "citing_url": [item.get("link") or "" for item in citing_items],
+                        "citing_snippet": [item.get("snippet") or "" for item in citing_items],
+                        "final_class": None,
+                        "crossref_type": None,
+                        **lens_fields(None),
+                    })
+                    batch = await classify_batch(session, batch)
+                    writer.write_table(pa.Table.from_pandas(batch, preserve_index=False).cast(CITATION_SCHEMA))
+                    n_rows += len(batch)
                 pbar.update(1)
-                continue
-            cites_id = extract_cites_id(link)
-            citing_items = get_citing_articles_by_cites_id(cites_id, MAX_CITES_PER_PUB)
-            for item in citing_items:
-                c_title = item.get("title") or ""
-                c_url = item.get("link") or ""
-                c_pub_info = safe_get(item, ["publication_info", "summary"], "")
-                c_snippet = item.get("snippet") or ""
-                final_class, crossref_type, lens_meta = classify_item(c_title, c_pub_info)
-                rows.append({
-                    "cited_pub_title": p_title,
-                    "cited_pub_year": p_year,
-                    "cited_by_count_at_scrape": cite_count,
-                    "citing_title": c_title,
-                    "citing_container": c_pub_info,
-                    "citing_url": c_url,
-                    "citing_snippet": c_snippet,
-                    "final_class": final_class,
-                    "crossref_type": crossref_type,
-                    "lens_id": (lens_meta or {}).get("lens_id"),
-                    "lens_publication_number": (lens_meta or {}).get("publication_number"),
-                    "lens_publication_date": (lens_meta or {}).get("publication_date"),
-                    "lens_jurisdiction": (lens_meta or {}).get("jurisdiction"),
-                    "lens_family_id": (lens_meta or {}).get("family_id"),
-                    "lens_applicants": json.dumps((lens_meta or {}).get("applicants")) if lens_meta else None,
-                    "lens_owners": json.dumps((lens_meta or {}).get("owners")) if lens_meta else None,
-                    "lens_inventors": json.dumps((lens_meta or {}).get("inventors")) if lens_meta else None,
-                })
-            pbar.update(1)
-
-    if not rows:
+    return n_rows
+
+def run_full(pubs):
+    targets = []
+    for pub in pubs[:MAX_PUBS]:
+        cited_by = pub.get("cited_by") or {}
+        cite_count = cited_by.get("value", 0)
+        link = cited_by.get("link")
+        if not link or cite_count == 0:
+            continue
+        max_items = min(MAX_CITES_PER_PUB, cite_count) if isinstance(cite_count, int) else MAX_CITES_PER_PUB
+        targets.append((pub, cite_count, extract_cites_id(link), max_items))
+
+    path_all_parquet = os.path.join(OUTPUT_DIR, "all_citations.parquet")
+    n_rows = asyncio.run(collect_citations(targets, path_all_parquet))
+
+    if not n_rows:
+        os.remove(path_all_parquet)
         print("No citing items found.")
         return
 
-    df = pd.DataFrame(rows)
-    df_reviews = df[df["final_class"] == "review"]
-    df_patents = df[df["final_class"] == "patent"]
-    df_books = df[df["final_class"] == "book"]
-    df_thesis = df[df["final_class"] == "thesis"]
+    df = arrow_to_frame(pq.read_table(path_all_parquet))
+    groups = {k: v for k, v in df.groupby("final_class", sort=False, observed=True)}
+    df_reviews = groups.get("review", df.iloc[:0])
+    df_patents = groups.get("patent", df.iloc[:0])
+    df_books = groups.get("book", df.iloc[:0])
+    df_thesis = groups.get("thesis", df.iloc[:0])
 
     path_all_csv = os.path.join(OUTPUT_DIR, "all_citations.csv")
     path_reviews_csv = os.path.join(OUTPUT_DIR, "reviews_citing_you.csv")
@@ -284,31 +550,37 @@ def run_full(pubs):
     path_books_csv = os.path.join(OUTPUT_DIR, "books_citing_you.csv")
     path_thesis_csv = os.path.join(OUTPUT_DIR, "theses_citing_you.csv")
 
-    df.to_csv(path_all_csv, index=False)
-    df_reviews.to_csv(path_reviews_csv, index=False)
-    df_patents.to_csv(path_patents_csv, index=False)
-    df_books.to_csv(path_books_csv, index=False)
-    df_thesis.to_csv(path_thesis_csv, index=False)
-
     path_xlsx = os.path.join(OUTPUT_DIR, "citations_export.xlsx")
-    with pd.ExcelWriter(path_xlsx, engine="openpyxl") as xw:
-        df.to_excel(xw, index=False, sheet_name="All")
-        df_reviews.to_excel(xw, index=False, sheet_name="Reviews")
-        df_patents.to_excel(xw, index=False, sheet_name="Patents")
-        df_books.to_excel(xw, index=False, sheet_name="Books")
-        df_thesis.to_excel(xw, index=False, sheet_name="Theses")
-
-    gexf_path, graphml_path = build_graph_and_export(df)
+
+    # The exports are independent; the graph is built while CSVs and the workbook are written
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as ex:
+        futures = [ex.submit(frame.to_csv, path, index=False, chunksize=CSV_CHUNKSIZE) for frame, path in [
+            (df, path_all_csv),
+            (df_reviews, path_reviews_csv),
+            (df_patents, path_patents_csv),
+            (df_books, path_books_csv),
+            (df_thesis, path_thesis_csv),
+        ]]
+        futures.append(ex.submit(write_excel, path_xlsx, {
+            "All": df,
+            "Reviews": df_reviews,
+            "Patents": df_patents,
+            "Books": df_books,
+            "Theses": df_thesis,
+        }))
+        gexf_path, graphml_path = build_graph_and_export(df)
+        for f in futures:
+            f.result()
     print("\nExport complete")
     print(f"  All citations: {len(df)}")
     print(f"  Reviews: {len(df_reviews)} | Patents: {len(df_patents)} | Books: {len(df_books)} | Theses: {len(df_thesis)}")
-    print(f"  CSVs and Excel saved in {OUTPUT_DIR}")
+    print(f"  CSVs, Parquet and Excel saved in {OUTPUT_DIR}")
     print(f"  Graphs: {gexf_path}, {graphml_path}")
 
 # ===========================
 # Menu and control flow
 # ===========================
-def menu():
+def menu(refresh: bool = False):
     global SERPAPI_KEY, LENS_API_TOKEN, AUTHOR_ID, MAX_PUBS, MAX_CITES_PER_PUB
 
     print("==============================")
@@ -325,7 +597,7 @@ def menu():
     full_mode = (mode == "full")
 
     print("\nFetching your publications...")
-    pubs = get_publications(AUTHOR_ID)
+    pubs = get_publications(AUTHOR_ID, refresh=refresh)
     if not pubs:
         print("No publications found or API error.")
         return
@@ -377,4 +649,8 @@ def menu():
             print("Invalid choice.")
 
 if __name__ == "__main__":
-    menu()
+    parser = argparse.ArgumentParser(description="High Impact Citation Analyzer")
+    parser.add_argument("--refresh", action="store_true",
+                        help="re-fetch the publication list even if a fresh cached copy exists")
+    args = parser.parse_args()
+    menu(refresh=args.refresh)
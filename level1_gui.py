@@ -1,12 +1,15 @@
 import os
 import sys
 import subprocess
+import importlib.util
 import time
+import re
 import json
+import queue
+import threading
 import requests
 import pandas as pd
 import networkx as nx
-from urllib.parse import urlparse, parse_qs
 from tkinter import Tk, Label, Entry, Button, StringVar, Text, END, ttk, filedialog, Scrollbar
 
 # ===========================
@@ -15,12 +18,12 @@ from tkinter import Tk, Label, Entry, Button, StringVar, Text, END, ttk, filedia
 REQUIRED = ["pandas", "networkx", "requests", "serpapi", "openpyxl", "tqdm"]
 
 def ensure_deps():
+    # find_spec only locates the package; nothing is imported until it is actually used
     for pkg in REQUIRED:
-        try:
-            __import__(pkg)
-        except ImportError:
+        if importlib.util.find_spec(pkg) is None:
             print(f"Installing missing package: {pkg}")
             subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
+            importlib.invalidate_caches()
 
 ensure_deps()
 
@@ -48,14 +51,38 @@ SLEEP_LENS = 0.5
 OUTPUT_DIR = "scholar_outputs_level1_gui"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+UI_POLL_MS = 100
+
 # ===========================
 # Core functions (same as before)
 # ===========================
+# The analysis runs on a worker thread; it only queues UI updates, which Tk applies on a timer
+_ui_q = queue.Queue()
+
 def log(msg):
     """Helper to log into GUI text box."""
-    console.insert(END, msg + "\n")
-    console.see(END)
-    root.update()
+    _ui_q.put(("log", msg))
+
+def set_progress(value):
+    _ui_q.put(("progress", value))
+
+def _drain_ui_queue():
+    lines = []
+    while True:
+        try:
+            kind, value = _ui_q.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "log":
+            lines.append(value)
+        elif kind == "progress":
+            progress['value'] = value
+        elif kind == "done":
+            start_button.config(state="normal")
+    if lines:
+        console.insert(END, "\n".join(lines) + "\n")
+        console.see(END)
+    root.after(UI_POLL_MS, _drain_ui_queue)
 
 def get_publications(author_id: str) -> list:
     pubs = []
@@ -80,19 +107,11 @@ def get_publications(author_id: str) -> list:
         time.sleep(SLEEP_AUTHOR_PAGE)
     return pubs
 
+_CITES_RE = re.compile(r"[?&]cites=([^&#]+)")
+
 def extract_cites_id(cited_by_link: str) -> str | None:
-    if not cited_by_link:
-        return None
-    try:
-        parsed = urlparse(cited_by_link)
-        q = parse_qs(parsed.query)
-        if "cites" in q and q["cites"]:
-            return q["cites"][0]
-        if "cites=" in cited_by_link:
-            return cited_by_link.split("cites=")[1].split("&")[0]
-    except Exception:
-        return None
-    return None
+    m = _CITES_RE.search(cited_by_link or "")
+    return m.group(1) if m else None
 
 def get_citing_articles_by_cites_id(cites_id: str, max_items: int) -> list:
     results_all = []
@@ -133,16 +152,20 @@ def crossref_lookup_type(title: str) -> str:
         time.sleep(SLEEP_CROSSREF)
     return "unknown"
 
+_RE_REVIEW = re.compile(r"review|survey|meta-analysis|systematic review", re.IGNORECASE)
+_RE_PATENT = re.compile(r"patent", re.IGNORECASE)
+_RE_BOOK = re.compile(r"book|chapter|handbook|monograph|springer|igi-global|ieee press|acm books", re.IGNORECASE)
+_RE_THESIS = re.compile(r"thesis|dissertation|phd|masters", re.IGNORECASE)
+
 def heuristic_classify(title: str, container: str) -> str:
-    t = (title or "").lower()
-    c = (container or "").lower()
-    if any(w in t or w in c for w in ["review", "survey", "meta-analysis", "systematic review"]):
+    text = f"{title or ''}\n{container or ''}"
+    if _RE_REVIEW.search(text):
         return "review"
-    if "patent" in t or "patent" in c:
+    if _RE_PATENT.search(text):
         return "patent"
-    if any(w in t or w in c for w in ["book", "chapter", "handbook", "monograph", "springer", "igi-global", "ieee press", "acm books"]):
+    if _RE_BOOK.search(text):
         return "book"
-    if any(w in t or w in c for w in ["thesis", "dissertation", "phd", "masters"]):
+    if _RE_THESIS.search(text):
         return "thesis"
     return "unknown"
 
@@ -171,18 +194,36 @@ def safe_get(dic: dict, path: list, default=None):
 # ===========================
 # Run analysis
 # ===========================
-def run_analysis():
-    global SERPAPI_KEY, LENS_API_TOKEN, AUTHOR_ID, MAX_PUBS, MAX_CITES_PER_PUB
-
-    AUTHOR_ID = scholar_id_var.get().strip()
-    SERPAPI_KEY = serpapi_var.get().strip()
-    LENS_API_TOKEN = lens_var.get().strip()
+def start_analysis():
+    # Tk variables are read here, on the main thread, before handing off to the worker
+    author_id = scholar_id_var.get().strip()
+    serpapi_key = serpapi_var.get().strip()
+    lens_token = lens_var.get().strip()
     mode = mode_var.get()
 
-    if not AUTHOR_ID or not SERPAPI_KEY:
+    if not author_id or not serpapi_key:
         log("Scholar ID and SerpAPI Key are required.")
         return
 
+    start_button.config(state="disabled")
+    set_progress(0)
+    threading.Thread(target=run_analysis, args=(author_id, serpapi_key, lens_token, mode), daemon=True).start()
+
+def run_analysis(author_id, serpapi_key, lens_token, mode):
+    try:
+        analyze(author_id, serpapi_key, lens_token, mode)
+    except Exception as e:
+        log(f"Error: {e}")
+    finally:
+        _ui_q.put(("done", None))
+
+def analyze(author_id, serpapi_key, lens_token, mode):
+    global SERPAPI_KEY, LENS_API_TOKEN, AUTHOR_ID, MAX_PUBS, MAX_CITES_PER_PUB
+
+    AUTHOR_ID = author_id
+    SERPAPI_KEY = serpapi_key
+    LENS_API_TOKEN = lens_token
+
     log("Fetching publications...")
     pubs = get_publications(AUTHOR_ID)
     if not pubs:
@@ -236,8 +277,7 @@ def run_analysis():
                 "final_class": final_class,
                 "crossref_type": crossref_type
             })
-        progress['value'] = (idx / MAX_PUBS) * 100
-        root.update_idletasks()
+        set_progress((idx / MAX_PUBS) * 100)
 
     if not rows:
         log("No citing items found.")
@@ -273,7 +313,8 @@ Label(root, text="Mode").pack()
 mode_var = StringVar(value="Single")
 ttk.Combobox(root, textvariable=mode_var, values=["Single", "Full"], width=20).pack()
 
-Button(root, text="Start Analysis", command=run_analysis).pack(pady=100)
+start_button = Button(root, text="Start Analysis", command=start_analysis)
+start_button.pack(pady=100)
 
 Label(root, text="Progress").pack()
 progress = ttk.Progressbar(root, orient="horizontal", length=400, mode="determinate")
@@ -286,4 +327,5 @@ scroll = Scrollbar(root, command=console.yview)
 console.config(yscrollcommand=scroll.set)
 scroll.pack(side="right", fill="y")
 
+_drain_ui_queue()
 root.mainloop()
\ No newline at end of file
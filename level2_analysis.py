@@ -1,17 +1,43 @@
 import os
 import re
+import argparse
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import numpy as np
 import pandas as pd
-import requests
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 # --------------------------------------------------
 # Configuration
 # --------------------------------------------------
 INPUT_FILE = "scholar_outputs_level1/all_citations.csv"
 OUTPUT_DIR = "scholar_outputs_level2"
-CACHE_FILE = "metadata_cache.json"
+CACHE_FILE = "metadata_cache.jsonl"
+LEGACY_CACHE_FILE = "metadata_cache.json"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+OPENALEX_API = "https://api.openalex.org/works"
+CROSSREF_API = "https://api.crossref.org/works"
+MAILTO = ""  # set to your email to use the OpenAlex/Crossref polite pools
+HTTP_TIMEOUT = 8
+OPENALEX_CONCURRENCY = 10  # OpenAlex allows 10 requests/second
+CROSSREF_CONCURRENCY = 5
+DOI_BATCH_SIZE = 50  # DOIs per filter query; larger batches risk 414 URI Too Long
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF = 0.5  # seconds; doubles on every retry unless the server sends Retry-After
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TEXT_DTYPE = "string[pyarrow]"
+TEXT_COLUMNS = ["citing_title", "citing_container", "citing_abstract", "citing_url", "crossref_type"]
+META_FIELDS = ["type", "venue_type"]
+CATEGORY_COLUMNS = ["final_class", "crossref_type", "lens_jurisdiction"]  # few distinct values; read as categoricals
+EXPORT_WORKERS = 4
+CLASSIFY_WORKERS = os.cpu_count() or 1
+CLASSIFY_CHUNK_ROWS = 50_000  # inputs smaller than two chunks are classified on the calling thread
+
 LABEL_PRIORITY = [
     "patent",
     "thesis",
@@ -22,271 +48,461 @@ LABEL_PRIORITY = [
     "preprint",
     "unknown"
 ]
+# Column of each label in the score matrix; a lower rank wins top_label
+LABEL_RANK = {label: i for i, label in enumerate(LABEL_PRIORITY)}
 
 # --------------------------------------------------
 # Helper functions
 # --------------------------------------------------
-def normalize(x):
-    return str(x).strip().lower() if x is not None and not pd.isna(x) else ""
+def text_column(df, name):
+    # Arrow-backed strings send str.contains to RE2, which matches a whole fused
+    # alternation in one linear pass instead of backtracking row by row in Python
+    if name not in df:
+        return pd.Series("", index=df.index, dtype=TEXT_DTYPE)
+    return df[name].astype(TEXT_DTYPE).fillna("").str.strip().str.lower()
+
+def normalized_text(df):
+    """Stripped, lowercased copies of the text columns, computed once for the lookup and the classifier."""
+    return pd.DataFrame({name: text_column(df, name) for name in TEXT_COLUMNS}, index=df.index)
+
+def contains(s, regex):
+    # Arrow string columns only take the pattern source; they compile it with RE2
+    return s.str.contains(regex.pattern)
+
+def any_of(patterns):
+    return "|".join(f"(?:{p})" for p in patterns)
+
+def any_literal(words):
+    return "|".join(re.escape(w) for w in words)
 
-def match_any(patterns, text):
-    return any(re.search(p, text) for p in patterns)
+def is_patent_field(s):
+    return s.notna() & ~s.astype(str).str.strip().str.lower().isin(["", "nan", "none", "0"])
 
-def is_patent_field(x):
-    if x is None or pd.isna(x):
-        return False
-    s = str(x).strip().lower()
-    return s not in ["", "nan", "none", "0"]
+def lens_column(df, name, alt_name):
+    for n in (name, alt_name):
+        if n in df:
+            return df[n]
+    return pd.Series(None, index=df.index, dtype=object)
 
 # --------------------------------------------------
-# Metadata enrichment
+# Classification rules
 # --------------------------------------------------
-def extract_doi_from_url(url):
-    url = normalize(url)
-    m = re.search(r"10\.\d{4,9}/[-._;()/:A-Z0-9]+", url, re.I)
-    return m.group(0) if m else None
-
-def extract_arxiv_id(url):
-    url = normalize(url)
-    m = re.search(r"arxiv\.org/(abs|pdf)/([0-9]+\.[0-9]+)", url)
-    return m.group(2) if m else None
-
-def query_openalex(doi=None, arxiv_id=None):
-    try:
-        if doi:
-            r = requests.get(f"https://api.openalex.org/works/https://doi.org/{doi}", timeout=8)
-        elif arxiv_id:
-            r = requests.get(f"https://api.openalex.org/works/arxiv:{arxiv_id}", timeout=8)
-        else:
-            return None
-        if r.status_code == 200:
-            return r.json()
-    except Exception:
-        return None
-    return None
+# Each rule list is fused into a single alternation and compiled once at import
+PATENT_PATTERNS = [
+    r"patents\.google\.com",
+    r"lens\.org",
+    r"uspto\.gov",
+    r"\bUS[\s-]*\d+[\s-]*[AB]\d+\b",
+    r"\bEP[\s-]*\d+\b",
+    r"\bWO[\s-]*\d+\b",
+    r"\bCN[\s-]*\d+\b",
+    r"\bKR[\s-]*\d+\b",
+    r"\bJP[\s-]*\d+\b"
+]
+THESIS_DOMAINS = [
+    "search.proquest.com", "pqdtopen.proquest.com", "theses.fr", "ethos.bl.uk",
+    "dspace", "etd.", "repository.", "hdl.handle.net", "openscholarship",
+    "escholarship", ".library."
+]
+THESIS_ABSTRACT_PATTERNS = [
+    r"submitted\s+(?:to|by)",
+    r"in partial fulfillment of the requirements",
+    r"this (?:thesis|dissertation)"
+]
+SURVEY_PHRASES = [
+    r"in this survey", r"in this review", r"this survey", r"this review",
+    r"this paper (?:presents|provides|gives) (?:a )?(?:comprehensive )?(?:survey|review)",
+    r"comprehensive survey", r"systematic review", r"literature review",
+    r"overview of the state of the art", r"\bwe survey\b", r"\bwe review\b"
+]
+LNCS_PATTERNS = [
+    r"lecture notes in computer science", r"lecture notes in artificial intelligence",
+    r"lecture notes in bioinformatics", r"\blncs\b", r"\blnai\b", r"\blnbi\b",
+    r"/chapter/10\.1007/"
+]
+STRONG_DOI_PREFIXES = ["10.1007/978", "10.1016/B", "10.1201/", "10.1093/", "10.4324/"]
+STRONG_BOOK_URL_PARTS = STRONG_DOI_PREFIXES + ["link.springer.com/book/"]
+BOOK_PUBLISHERS = ["cambridge.org", "elsevier", "taylorandfrancis", "oxfordacademic", "crcpress", "routledge"]
+BOOK_KEYWORDS = [r"\bhandbook\b", r"\bencyclopedia\b", r"\btextbook\b", r"\bmonograph\b", r"\bspringerbriefs\b"]
+BOOK_META_TYPES = ["book", "book-chapter", "edited-book", "monograph"]
+NOT_BOOK_CONTAINER_WORDS = [
+    "lncs", "lecture notes in computer science", "journal", "transactions",
+    "symposium", "conference", "workshop", "proceedings"
+]
+PREPRINT_DOMAINS = ["researchgate.net", "academia.edu", "arxiv.org"]
+
+# Patent patterns stay case-sensitive; the text they run on is already lowercased
+_PATENT_RE = re.compile(any_of(PATENT_PATTERNS))
+_THESIS_DOMAIN_RE = re.compile(any_literal(THESIS_DOMAINS))
+_THESIS_META_RE = re.compile(r"thesis|dissertation")
+_THESIS_TITLE_RE = re.compile(r"\b(?:thesis|dissertation|doctoral|phd|master(?:'|)s)\b")
+_THESIS_ABSTRACT_RE = re.compile(any_of(THESIS_ABSTRACT_PATTERNS))
+_THESIS_CONTAINER_RE = re.compile(r"thesis|dissertation|submitted to|graduate school|department")
+_SURVEY_RE = re.compile(any_of(SURVEY_PHRASES))
+_REVIEW_TITLE_START_RE = re.compile(r"^(?:a\s+(?:comprehensive\s+)?(?:survey|review)|systematic review)")
+_REVIEW_WORD_RE = re.compile(r"\bsurvey\b|\breview\b")
+_NOT_REVIEW_RE = re.compile(r"book review|peer review|double blind review")
+_LNCS_RE = re.compile(any_of(LNCS_PATTERNS))
+_STRONG_BOOK_URL_RE = re.compile(any_literal(STRONG_BOOK_URL_PARTS))
+_BOOK_PUBLISHER_RE = re.compile(any_literal(BOOK_PUBLISHERS))
+_BOOK_KW_RE = re.compile(any_of(BOOK_KEYWORDS))
+_ISBN_RE = re.compile(r"\b97[89][-\d]{10,}\b")
+_NOT_BOOK_CONTAINER_RE = re.compile(any_literal(NOT_BOOK_CONTAINER_WORDS))
+_JOURNAL_CONTAINER_RE = re.compile(r"journal|transactions")
+_PREPRINT_RE = re.compile(any_literal(PREPRINT_DOMAINS))
+_DOI_RE = re.compile(r"(10\.\d{4,9}/[-._;()/:A-Z0-9]+)", re.I)
+_ARXIV_RE = re.compile(r"arxiv\.org/(abs|pdf)/([0-9]+\.[0-9]+)")
 
-def query_crossref(doi):
-    try:
-        r = requests.get(f"https://api.crossref.org/works/{doi}", timeout=8)
-        if r.status_code == 200:
-            return r.json().get("message", {})
-    except Exception:
-        return None
+# --------------------------------------------------
+# Metadata enrichment
+# --------------------------------------------------
+def metadata_keys(urls):
+    """doi:<doi> where the (normalized) url carries a DOI, else arxiv:<id>, else NA."""
+    doi = urls.str.extract(_DOI_RE, expand=False)
+    arxiv_id = urls.str.extract(_ARXIV_RE)[1]
+    return ("doi:" + doi).fillna("arxiv:" + arxiv_id)
+
+def openalex_record(meta):
+    return {
+        "source": "openalex",
+        "type": meta.get("type"),
+        "venue_type": (meta.get("host_venue") or {}).get("type"),
+        "publisher": (meta.get("host_venue") or {}).get("publisher")
+    }
+
+def crossref_record(meta):
+    return {
+        "source": "crossref",
+        "type": meta.get("type"),
+        "venue_type": None,
+        "publisher": meta.get("publisher")
+    }
+
+async def fetch_json(session, sem, url, params=None):
+    # Rate limits, 5xx and dropped connections are retried; an unreachable host is not
+    async with sem:
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                async with session.get(url, params=params) as r:
+                    if r.status == 200:
+                        return await r.json(content_type=None)
+                    if r.status not in RETRY_STATUSES:
+                        return None
+                    retry_after = r.headers.get("Retry-After")
+            except (aiohttp.ClientConnectorError, ValueError):
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            if attempt < HTTP_MAX_RETRIES:
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else HTTP_BACKOFF * 2 ** attempt
+                await asyncio.sleep(delay)
     return None
 
-def enrich_metadata(url, cache):
-    doi = extract_doi_from_url(url)
-    arxiv_id = extract_arxiv_id(url)
-    key = f"doi:{doi}" if doi else f"arxiv:{arxiv_id}" if arxiv_id else None
-
-    if key and key in cache:
-        return cache[key]
-
-    result = None
-    if doi or arxiv_id:
-        meta = query_openalex(doi, arxiv_id)
-        if meta:
-            result = {
-                "source": "openalex",
-                "type": meta.get("type"),
-                "venue_type": (meta.get("host_venue") or {}).get("type"),
-                "publisher": (meta.get("host_venue") or {}).get("publisher")
-            }
-
-    if doi and not result:
-        meta = query_crossref(doi)
-        if meta:
-            result = {
-                "source": "crossref",
-                "type": meta.get("type"),
-                "venue_type": None,
-                "publisher": meta.get("publisher")
-            }
-
-    if key:
-        cache[key] = result
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache, f, indent=2)
-
-    return result
+async def query_openalex_dois(session, sem, dois):
+    params = {"filter": "doi:" + "|".join(f"https://doi.org/{d}" for d in dois), "per-page": len(dois)}
+    if MAILTO:
+        params["mailto"] = MAILTO
+    data = await fetch_json(session, sem, OPENALEX_API, params)
+    found = {}
+    for work in (data or {}).get("results", []):
+        doi = (work.get("doi") or "").lower().removeprefix("https://doi.org/")
+        found[doi] = openalex_record(work)
+    return found
+
+async def query_openalex_arxiv(session, sem, arxiv_id):
+    data = await fetch_json(session, sem, f"{OPENALEX_API}/arxiv:{arxiv_id}")
+    return openalex_record(data) if data else None
+
+async def query_crossref_dois(session, sem, dois):
+    params = {"filter": ",".join(f"doi:{d}" for d in dois), "rows": len(dois)}
+    if MAILTO:
+        params["mailto"] = MAILTO
+    data = await fetch_json(session, sem, CROSSREF_API, params)
+    items = ((data or {}).get("message") or {}).get("items", [])
+    return {(item.get("DOI") or "").lower(): crossref_record(item) for item in items}
+
+def batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+async def gather_all(keys):
+    """Look up every key concurrently: OpenAlex first, Crossref for the DOIs OpenAlex doesn't know."""
+    dois = [k[len("doi:"):] for k in keys if k.startswith("doi:")]
+    arxiv_ids = [k[len("arxiv:"):] for k in keys if k.startswith("arxiv:")]
+    results = dict.fromkeys(keys)
+
+    ua = "ScholarlyImpactAnalysis/1.0" + (f" (mailto:{MAILTO})" if MAILTO else "")
+    timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    # One keep-alive pool for the whole run, sized to the number of requests in flight
+    connector = aiohttp.TCPConnector(limit=OPENALEX_CONCURRENCY + CROSSREF_CONCURRENCY, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"User-Agent": ua}) as session:
+        oa_sem = asyncio.Semaphore(OPENALEX_CONCURRENCY)
+        cr_sem = asyncio.Semaphore(CROSSREF_CONCURRENCY)
+
+        oa_batches, oa_arxiv = await asyncio.gather(
+            asyncio.gather(*(query_openalex_dois(session, oa_sem, b) for b in batches(dois, DOI_BATCH_SIZE))),
+            asyncio.gather(*(query_openalex_arxiv(session, oa_sem, a) for a in arxiv_ids)),
+        )
+        for found in oa_batches:
+            for doi, record in found.items():
+                if f"doi:{doi}" in results:
+                    results[f"doi:{doi}"] = record
+        for arxiv_id, record in zip(arxiv_ids, oa_arxiv):
+            results[f"arxiv:{arxiv_id}"] = record
+
+        missing = [d for d in dois if results[f"doi:{d}"] is None]
+        cr_batches = await asyncio.gather(*(query_crossref_dois(session, cr_sem, b) for b in batches(missing, DOI_BATCH_SIZE)))
+        for found in cr_batches:
+            for doi, record in found.items():
+                if results.get(f"doi:{doi}", False) is None:
+                    results[f"doi:{doi}"] = record
+    return results
+
+def load_cache():
+    cache = {}
+    # Pick up entries from the old single-document cache so existing lookups aren't repeated
+    if os.path.exists(LEGACY_CACHE_FILE):
+        with open(LEGACY_CACHE_FILE, "r", encoding="utf-8") as f:
+            try:
+                cache.update(json.load(f))
+            except json.JSONDecodeError:
+                pass
+    if os.path.exists(CACHE_FILE):
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    cache[rec["key"]] = rec.get("meta")
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+    return cache
+
+def append_cache(cache, found):
+    # Append-only: each run writes just its new entries instead of re-serializing the whole cache
+    cache.update(found)
+    with open(CACHE_FILE, "a", encoding="utf-8") as f:
+        f.writelines(json.dumps({"key": k, "meta": v}) + "\n" for k, v in found.items())
+
+def enrich_metadata(urls, cache):
+    """Return the type / venue_type metadata aligned with urls.
+
+    Keys missing from the cache are fetched in one async pass; the records are then looked up
+    once per distinct key and reindexed onto the rows.
+    """
+    keys = metadata_keys(urls)
+    distinct = keys.dropna().unique()
+    missing = sorted(set(distinct) - cache.keys())
+    if missing:
+        append_cache(cache, asyncio.run(gather_all(missing)))
+    table = pd.DataFrame([cache[k] or {} for k in distinct], index=distinct, columns=META_FIELDS)
+    return table.reindex(keys).set_axis(urls.index)
 
 # --------------------------------------------------
 # Classifier
 # --------------------------------------------------
-def classify_item(title, container, abstract, crossref_type,
-                  lens_id, lens_pub_number, lens_family_id, url, meta):
-
-    labels = {}
-    t = normalize(title)
-    c = normalize(container)
-    a = normalize(abstract)
-    u = normalize(url)
-    cr = normalize(crossref_type)
-    tcau = f"{t} {c} {a} {u} {cr}"
-
-    meta_type = normalize(meta["type"]) if meta and meta.get("type") else ""
-    meta_venue_type = normalize(meta["venue_type"]) if meta and meta.get("venue_type") else ""
-
-    # 1. Patent (revised)
-    patent_patterns = [
-        r"patents\.google\.com",
-        r"lens\.org",
-        r"uspto\.gov",
-        r"\bUS[\s-]*\d+[\s-]*[AB]\d+\b",
-        r"\bEP[\s-]*\d+\b",
-        r"\bWO[\s-]*\d+\b",
-        r"\bCN[\s-]*\d+\b",
-        r"\bKR[\s-]*\d+\b",
-        r"\bJP[\s-]*\d+\b"
-    ]
-    if (
-        is_patent_field(lens_id) or
-        is_patent_field(lens_pub_number) or
-        is_patent_field(lens_family_id) or
-        match_any(patent_patterns, tcau)
-    ):
-        labels["patent"] = 5
-
-    # 2. Thesis
-    thesis_domains = [
-        "search.proquest.com", "pqdtopen.proquest.com", "theses.fr", "ethos.bl.uk",
-        "dspace", "etd.", "repository.", "hdl.handle.net", "openscholarship",
-        "escholarship", ".library."
-    ]
-    if any(d in u for d in thesis_domains):
-        labels["thesis"] = max(labels.get("thesis", 0), 5)
-    if "thesis" in meta_type or "dissertation" in meta_type:
-        labels["thesis"] = max(labels.get("thesis", 0), 5)
-    if re.search(r"\b(thesis|dissertation|doctoral|phd|master('|)s)\b", t):
-        labels["thesis"] = max(labels.get("thesis", 0), 4)
-    if re.search(r"submitted\s+(to|by)", a) or \
-       re.search(r"in partial fulfillment of the requirements", a) or \
-       re.search(r"this (thesis|dissertation)", a):
-        labels["thesis"] = max(labels.get("thesis", 0), 5)
-    if "university" in c and re.search(r"thesis|dissertation|submitted to|graduate school|department", c):
-        labels["thesis"] = max(labels.get("thesis", 0), 4)
-
-    # 3. Review / Survey
-    survey_phrases = [
-        r"in this survey", r"in this review", r"this survey", r"this review",
-        r"this paper (presents|provides|gives) (a )?(comprehensive )?(survey|review)",
-        r"comprehensive survey", r"systematic review", r"literature review",
-        r"overview of the state of the art", r"\bwe survey\b", r"\bwe review\b"
-    ]
-    if any(re.search(p, a) for p in survey_phrases):
-        labels["review"] = max(labels.get("review", 0), 5)
-    if re.search(r"^(a\s+(comprehensive\s+)?(survey|review)|systematic review)", t):
-        labels["review"] = max(labels.get("review", 0), 5)
-    if re.search(r"\bsurvey\b", t) or re.search(r"\breview\b", t):
-        if not re.search(r"book review|peer review|double blind review", t):
-            labels["review"] = max(labels.get("review", 0), 4)
-
-    # 4. Conference
-    lncs_patterns = [
-        r"lecture notes in computer science", r"lecture notes in artificial intelligence",
-        r"lecture notes in bioinformatics", r"\blncs\b", r"\blnai\b", r"\blnbi\b",
-        r"/chapter/10\.1007/"
-    ]
-    if match_any(lncs_patterns, tcau) or meta_venue_type == "conference" or "proceedings" in t:
-        labels["conference"] = max(labels.get("conference", 0), 4)
-
-    # 5. Book
-    strong_doi_prefixes = ["10.1007/978", "10.1016/B", "10.1201/", "10.1093/", "10.4324/"]
-    book_publishers = ["cambridge.org", "elsevier", "taylorandfrancis", "oxfordacademic", "crcpress", "routledge"]
-    book_keywords = [r"\bhandbook\b", r"\bencyclopedia\b", r"\btextbook\b", r"\bmonograph\b", r"\bspringerbriefs\b"]
-    isbn_pattern = r"\b97[89][-\d]{10,}\b"
-
-    strong_book = False
-    medium_book = False
-
-    if meta_type in ["book", "book-chapter", "edited-book", "monograph"]:
-        strong_book = True
-
-    if any(prefix in u for prefix in strong_doi_prefixes) or re.search(isbn_pattern, c) or "link.springer.com/book/" in u:
-        strong_book = True
-
-    if any(pub in u for pub in book_publishers) and not ("journal" in c or "journal-article" in cr or meta_venue_type == "journal"):
-        medium_book = True
-    if any(re.search(k, c) for k in book_keywords) or any(re.search(k, t) for k in book_keywords):
-        medium_book = True
-
-    if strong_book:
-        labels["book"] = max(labels.get("book", 0), 5)
-    elif medium_book:
-        labels["book"] = max(labels.get("book", 0), 2)
-
+def strongest(*rules):
+    """Per row, the highest score among the (mask, score) pairs that hit, else 0."""
+    out = np.zeros(len(rules[0][0]), dtype=np.int8)
+    for mask, score in rules:
+        out = np.maximum(out, np.where(mask.to_numpy(dtype=bool), score, 0))
+    return out
+
+def patent_rule(x):
+    # The Lens fields are cheap; the regex only runs on rows they don't already settle
+    hit = x["lens"].to_numpy(dtype=bool).copy()
+    hit[~hit] = contains(x["tcau"][~hit], _PATENT_RE).to_numpy(dtype=bool)
+    return np.where(hit, 5, 0).astype(np.int8)
+
+def thesis_rule(x):
+    t, c, a, u = x["t"], x["c"], x["a"], x["u"]
+    return strongest(
+        (contains(u, _THESIS_DOMAIN_RE), 5),
+        (contains(x["meta_type"], _THESIS_META_RE), 5),
+        (contains(t, _THESIS_TITLE_RE), 4),
+        (contains(a, _THESIS_ABSTRACT_RE), 5),
+        (c.str.contains("university", regex=False) & contains(c, _THESIS_CONTAINER_RE), 4),
+    )
+
+def review_rule(x):
+    t = x["t"]
+    return strongest(
+        (contains(x["a"], _SURVEY_RE), 5),
+        (contains(t, _REVIEW_TITLE_START_RE), 5),
+        (contains(t, _REVIEW_WORD_RE) & ~contains(t, _NOT_REVIEW_RE), 4),
+    )
+
+def conference_rule(x):
+    return strongest((contains(x["tcau"], _LNCS_RE) | (x["meta_venue_type"] == "conference") |
+                      x["t"].str.contains("proceedings", regex=False), 4))
+
+def is_journal(x):
+    return (x["meta_venue_type"] == "journal") | x["cr"].str.contains("journal-article", regex=False)
+
+def journal_rule(x):
+    return strongest((is_journal(x), 4), (contains(x["c"], _JOURNAL_CONTAINER_RE), 3))
+
+def book_rule(x):
+    t, c, u = x["t"], x["c"], x["u"]
+    journal = is_journal(x)
+    strong_book = (
+        x["meta_type"].isin(BOOK_META_TYPES) | contains(u, _STRONG_BOOK_URL_RE) | contains(c, _ISBN_RE)
+    )
+    medium_book = (
+        (contains(u, _BOOK_PUBLISHER_RE) & ~(c.str.contains("journal", regex=False) | journal)) |
+        contains(c, _BOOK_KW_RE) | contains(t, _BOOK_KW_RE)
+    )
     # Negative filters for book
-    if "lncs" in c or "lecture notes in computer science" in c:
-        labels.pop("book", None)
-    if meta_venue_type == "journal" or "journal-article" in cr:
-        labels.pop("book", None)
-    if "journal" in c or "transactions" in c:
-        labels.pop("book", None)
-    if "symposium" in c or "conference" in c or "workshop" in c or "proceedings" in c:
-        labels.pop("book", None)
-
-    # 6. Journal
-    if meta_venue_type == "journal" or "journal-article" in cr:
-        labels["journal"] = max(labels.get("journal", 0), 4)
-    if "journal" in c or "transactions" in c:
-        labels["journal"] = max(labels.get("journal", 0), 3)
-
-    # 7. Preprint
-    if "researchgate.net" in u or "academia.edu" in u or "arxiv.org" in u:
-        labels["preprint"] = max(labels.get("preprint", 0), 3)
-
-    # 8. Unknown
-    if not labels:
-        labels["unknown"] = 0
-
-    top_label = sorted(labels.keys(), key=lambda x: LABEL_PRIORITY.index(x))[0]
-    return labels, top_label
+    not_book = journal | contains(c, _NOT_BOOK_CONTAINER_RE)
+    return strongest((strong_book & ~not_book, 5), (medium_book & ~strong_book & ~not_book, 2))
+
+def preprint_rule(x):
+    return strongest((contains(x["u"], _PREPRINT_RE), 3))
+
+# In LABEL_PRIORITY order; "unknown" is whatever none of these claim
+LABEL_RULES = [
+    ("patent", patent_rule),
+    ("thesis", thesis_rule),
+    ("review", review_rule),
+    ("conference", conference_rule),
+    ("journal", journal_rule),
+    ("book", book_rule),
+    ("preprint", preprint_rule),
+]
+
+LENS_COLUMNS = [
+    ("lens_id", "Lens ID"),
+    ("lens_publication_number", "Lens Publication Number"),
+    ("lens_family_id", "Lens Family ID"),
+]
+
+def classify_frame(df, text, meta, fast=False):
+    """Score all rows at once; returns an int8 matrix with one column per LABEL_PRIORITY entry.
+
+    text is normalized_text(df) and meta the frame returned by enrich_metadata. With fast=True
+    each rule only runs on rows no higher-priority label has claimed, so only top_label is complete.
+    """
+    t, c, a, u, cr = (text[name] for name in TEXT_COLUMNS)
+    lens = pd.Series(False, index=df.index)
+    for name, alt in LENS_COLUMNS:
+        lens |= is_patent_field(lens_column(df, name, alt))
+    x = {
+        "t": t, "c": c, "a": a, "u": u, "cr": cr,
+        "tcau": t + " " + c + " " + a + " " + u + " " + cr,
+        "meta_type": text_column(meta, "type"),
+        "meta_venue_type": text_column(meta, "venue_type"),
+        "lens": lens,
+    }
+
+    scores = np.zeros((len(df), len(LABEL_PRIORITY)), dtype=np.int8)
+    rows = np.arange(len(df))
+    for label, rule in LABEL_RULES:
+        if fast:
+            if not len(rows):
+                break
+            part = rule({k: v.iloc[rows] for k, v in x.items()})
+            scores[rows, LABEL_RANK[label]] = part
+            rows = rows[part == 0]
+        else:
+            scores[:, LABEL_RANK[label]] = rule(x)
+    return scores
+
+def classify_parallel(df, text, meta, fast=False):
+    """classify_frame over row chunks on a thread pool; the Arrow regex kernels release the GIL."""
+    n = min(CLASSIFY_WORKERS, len(df) // CLASSIFY_CHUNK_ROWS)
+    if n < 2:
+        return classify_frame(df, text, meta, fast)
+    bounds = np.linspace(0, len(df), n + 1, dtype=int)
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        parts = ex.map(lambda ab: classify_frame(df.iloc[ab[0]:ab[1]], text.iloc[ab[0]:ab[1]], meta.iloc[ab[0]:ab[1]], fast),
+                       zip(bounds[:-1], bounds[1:]))
+        return np.vstack(list(parts))
+
+def distinct_rows(df, text):
+    """Group rows with identical classifier inputs.
+
+    Returns the position of each group's first row and every row's group number. The metadata
+    needs no column of its own: it is derived from the (normalized) url.
+    """
+    lens = pd.DataFrame({name: lens_column(df, name, alt).astype(TEXT_DTYPE) for name, alt in LENS_COLUMNS},
+                        index=df.index)
+    keys = pd.concat([text, lens], axis=1)
+    groups = keys.groupby(list(keys.columns), sort=False, dropna=False).ngroup().to_numpy()
+    first = np.unique(groups, return_index=True)[1]
+    return first, groups
+
+def add_label_columns(df, scores):
+    """Add labels / label_confidence / top_label to df and return the (rows x labels) hit mask.
+
+    Rows without any hit are 'unknown' with score 0.
+    """
+    hits = scores > 0
+    hits[:, LABEL_RANK["unknown"]] = ~hits.any(axis=1)
+
+    # Only a few distinct score rows occur; format each once and map the strings back
+    distinct, inverse = np.unique(scores, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    label_sets = [{label: int(row[rank]) for label, rank in LABEL_RANK.items() if row[rank] > 0} or {"unknown": 0}
+                  for row in distinct]
+    df["labels"] = np.array([";".join(d) for d in label_sets], dtype=object)[inverse]
+    df["label_confidence"] = np.array([json.dumps(d) for d in label_sets], dtype=object)[inverse]
+    df["top_label"] = np.array(LABEL_PRIORITY)[hits.argmax(axis=1)]
+    return hits
+
+def write_excel(path, sheets):
+    # constant_memory streams each row to disk, so rows go out in order batch by batch instead of via pandas
+    import xlsxwriter
+    with xlsxwriter.Workbook(path, {"constant_memory": True}) as wb:
+        for sheet_name, table in sheets.items():
+            ws = wb.add_worksheet(sheet_name)
+            ws.write_row(0, 0, table.column_names)
+            r = 1
+            for batch in table.to_batches():
+                for row in zip(*(col.to_pylist() for col in batch.columns)):
+                    ws.write_row(r, 0, row)
+                    r += 1
 
 # --------------------------------------------------
 # Main pipeline
 # --------------------------------------------------
-def refine_csv(input_file):
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            try:
-                cache = json.load(f)
-            except json.JSONDecodeError:
-                cache = {}
-    else:
-        cache = {}
-
-    df = pd.read_csv(input_file)
-    results = []
-    for _, row in df.iterrows():
-        meta = enrich_metadata(row.get("citing_url", ""), cache)
-        labels, top_label = classify_item(
-            row.get("citing_title", ""),
-            row.get("citing_container", ""),
-            row.get("citing_abstract", ""),
-            row.get("crossref_type", ""),
-            row.get("lens_id", None) or row.get("Lens ID", None),
-            row.get("lens_publication_number", None) or row.get("Lens Publication Number", None),
-            row.get("lens_family_id", None) or row.get("Lens Family ID", None),
-            row.get("citing_url", ""),
-            meta
-        )
-        r = row.to_dict()
-        r["labels"] = ";".join(labels.keys())
-        r["label_confidence"] = json.dumps(labels)
-        r["top_label"] = top_label
-        results.append(r)
-
-    out_df = pd.DataFrame(results)
-    out_df.to_csv(os.path.join(OUTPUT_DIR, "all_citations_refined.csv"), index=False)
-    for label in LABEL_PRIORITY:
-        subset = out_df[out_df["labels"].str.contains(label)]
-        subset.to_csv(os.path.join(OUTPUT_DIR, f"{label}_citations.csv"), index=False)
+def refine_csv(input_file, fast=False, xlsx=False):
+    cache = load_cache()
+
+    df = pd.read_csv(input_file, engine="pyarrow", dtype={c: "category" for c in CATEGORY_COLUMNS})
+    text = normalized_text(df)
+    meta = enrich_metadata(text["citing_url"], cache)
+
+    # The same citing work often shows up once per cited paper; classify each distinct input once
+    first, groups = distinct_rows(df, text)
+    scores = classify_parallel(df.iloc[first], text.iloc[first], meta.iloc[first], fast)[groups]
+    hits = add_label_columns(df, scores)
+    masks = {label: hits[:, rank] for label, rank in LABEL_RANK.items()}
+
+    # Arrow's CSV writer is much faster than DataFrame.to_csv; subsets are filtered slices of one table
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    subsets = {label: table.filter(mask) for label, mask in masks.items()}
+    exports = [(table, os.path.join(OUTPUT_DIR, "all_citations_refined.csv"))]
+    exports += [(subsets[label], os.path.join(OUTPUT_DIR, f"{label}_citations.csv")) for label in masks]
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as ex:
+        futures = [ex.submit(pacsv.write_csv, t, path) for t, path in exports]
+        futures.append(ex.submit(pq.write_table, table, os.path.join(OUTPUT_DIR, "all_citations_refined.parquet"),
+                                 compression="zstd"))
+        if xlsx:
+            sheets = {"All": table, **{label.capitalize(): t for label, t in subsets.items()}}
+            futures.append(ex.submit(write_excel, os.path.join(OUTPUT_DIR, "citations_refined.xlsx"), sheets))
+        for f in futures:
+            f.result()
 
     print(f"✅ Refinement complete. Results saved in '{OUTPUT_DIR}/'")
-    print(f"  All refined: {len(out_df)}")
-    for label in LABEL_PRIORITY:
-        print(f"  {label.capitalize():<12}: {len(out_df[out_df['labels'].str.contains(label)])}")
+    print(f"  All refined: {len(df)}")
+    for label, mask in masks.items():
+        print(f"  {label.capitalize():<12}: {int(mask.sum())}")
 
 # --------------------------------------------------
 if __name__ == "__main__":
-    refine_csv(INPUT_FILE)
+    parser = argparse.ArgumentParser(description="Refine Level 1 citation classes")
+    parser.add_argument("--fast", action="store_true",
+                        help="stop at each row's highest-priority label; labels/label_confidence then hold only top_label")
+    parser.add_argument("--xlsx", action="store_true",
+                        help="also write citations_refined.xlsx (one sheet per label); off by default since it is the slowest export")
+    args = parser.parse_args()
+    refine_csv(INPUT_FILE, fast=args.fast, xlsx=args.xlsx)